@@ -1,3 +1,9 @@
+import queue
+import re
+import threading
+import time
+from collections import OrderedDict
+
 import addonHandler
 import config
 import core
@@ -33,42 +39,118 @@ def getLanguageDisplayName(langCode):
 		pass
 	return langCode
 
+# Detection accuracy doesn't improve on longer text, so only this many characters are used
+MAX_DETECT_LENGTH = 512
+# Number of detection results kept for repeated utterances
+DETECT_CACHE_SIZE = 2048
+# Longest time (in seconds) speech waits for detection before using the default voice
+DETECT_TIMEOUT = 0.05
+# Most texts detected with a single detector call
+DETECT_BATCH_SIZE = 8
+# Text similar to the text detected this long ago (in nanoseconds) gets the same language
+DEBOUNCE_TIME = 50_000_000
+# Number of characters at the start or end of text compared for similarity
+DEBOUNCE_LENGTH = 16
+
 # Global variables
 synthClass = None
 synthLangs = {}
+# Keys of synthLangs, for set operations with the whitelist
+synthLangsSet = frozenset()
+# Sorted ((langCode, displayName), ...) of synthLangs for the settings panel, built on demand
+synthLangsDisplay = None
 detector = None
 
 
+_detectorLock = threading.Lock()
+
+
 def init_detector():
-	"""Initialize the fast-langdetect detector with lite model."""
+	"""Initialize the fast-langdetect detector with lite model, unless already done."""
 	global detector
-	# Use lite model (bundled, offline), no input length limit for speech
-	cfg = LangDetectConfig(model="lite", max_input_length=None)
-	detector = LangDetector(cfg)
+	with _detectorLock:
+		if detector is not None:
+			return
+		# Use lite model (bundled, offline), no input length limit for speech
+		cfg = LangDetectConfig(model="lite", max_input_length=None)
+		newDetector = LangDetector(cfg)
+		# Load the model now instead of on first detection
+		newDetector.detect('warm up')
+		detector = newDetector
 	log.debug('LangDetectSpeech: Initialized fast-langdetect detector')
 
 
+# Parsed settings, cached as (configVersion, value) until _config_version is bumped
+_config_version = 0
+_whitelist_cache = None
+_fallback_cache = None
+# Cached as (configVersion, synthClass, allowed)
+_allowed_cache = None
+
+
+def invalidateConfigCache():
+	"""Mark the cached settings as outdated, e.g. after they were changed."""
+	global _config_version
+	_config_version += 1
+
+
 def get_whitelist():
-	whitelist = config.conf['LangDetectSpeech']['whitelist'].strip()
-	if whitelist:
-		return [i.strip().lower() for i in whitelist.split(',')]
-	else:
-		return []
+	"""Get the set of whitelisted language codes (empty if all languages are allowed)."""
+	global _whitelist_cache
+	if _whitelist_cache is None or _whitelist_cache[0] != _config_version:
+		whitelist = config.conf['LangDetectSpeech']['whitelist'].strip()
+		if whitelist:
+			whitelist = frozenset(i.strip().lower() for i in whitelist.split(','))
+		else:
+			whitelist = frozenset()
+		_whitelist_cache = (_config_version, whitelist)
+	return _whitelist_cache[1]
 
 
 def get_fallback():
 	"""Get fallback language code."""
-	fallback = config.conf['LangDetectSpeech']['fallback'].strip().lower()
-	return fallback if fallback else 'en'
+	global _fallback_cache
+	if _fallback_cache is None or _fallback_cache[0] != _config_version:
+		fallback = config.conf['LangDetectSpeech']['fallback'].strip().lower()
+		_fallback_cache = (_config_version, fallback if fallback else 'en')
+	return _fallback_cache[1]
+
+
+def getAllowedLangs():
+	"""Get the languages supported by synth and in whitelist (if whitelist is set)."""
+	global _allowed_cache
+	if (
+		_allowed_cache is None
+		or _allowed_cache[0] != _config_version
+		or _allowed_cache[1] != synthClass
+	):
+		whitelist = get_whitelist()
+		allowed = whitelist & synthLangsSet if whitelist else synthLangsSet
+		_allowed_cache = (_config_version, synthClass, allowed)
+	return _allowed_cache[2]
+
+
+def getSynthLangsDisplay():
+	"""Get ((langCode, displayName), ...) of the synth languages, sorted by code."""
+	global synthLangsDisplay
+	if synthLangsDisplay is None:
+		synthLangsDisplay = tuple(
+			(langCode, getLanguageDisplayName(langCode)) for langCode in sorted(synthLangs)
+		)
+	return synthLangsDisplay
 
 
 def updateSynthLangs():
 	"""Update the available synthesizer languages."""
 	global synthClass
 	global synthLangs
-	curSynthClass = str(speech.synthDriverHandler.getSynth().__class__)
-	if curSynthClass != synthClass:
+	global synthLangsSet
+	global synthLangsDisplay
+	# Compare the class itself, formatting its name for each speech sequence is slower
+	curSynthClass = speech.synthDriverHandler.getSynth().__class__
+	if curSynthClass is not synthClass:
 		synthClass = curSynthClass
+		clearDetectCache()
 		synthLangs = {}
 		try:
 			for voiceId in speech.synthDriverHandler.getSynth().availableVoices:
@@ -80,6 +162,8 @@ def updateSynthLangs():
 			synthLangs = {}
 			fallback = get_fallback()
 			synthLangs[fallback] = fallback
+		synthLangsSet = frozenset(synthLangs)
+		synthLangsDisplay = None
 
 		log.info('LANGPREDICT:\nFound voices:\n' +
 			'\n'.join(
@@ -89,14 +173,13 @@ def updateSynthLangs():
 
 		# Initialize whitelist if not all languages are in Synthesizer
 		whitelist = get_whitelist()
-		for lang in whitelist:
-			if lang not in synthLangs.keys():
-				whitelist = []
-				break
+		if not whitelist.issubset(synthLangsSet):
+			whitelist = frozenset()
 
 		# Initialize with all supported languages, if whitelist empty or reset
 		if not whitelist:
 			config.conf['LangDetectSpeech']['whitelist'] = ', '.join(synthLangs.keys())
+			invalidateConfigCache()
 
 
 def getDefaultLang():
@@ -110,77 +193,336 @@ def getDefaultLang():
 
 def detectLanguage(text: str):
 	"""Detect language of text and return appropriate language code for synth."""
-	global detector
-
+	global _lastDetect
 	defaultLang = getDefaultLang()
 
 	# Skip empty or very short text
 	text = text.strip()
 	if len(text) < 3:
 		return defaultLang
+	text = text[:MAX_DETECT_LENGTH]
+
+	# NVDA repeats the same utterances (control labels, "OK", "Cancel", ...) very often.
+	# synthClass is part of the key, as the result depends on the synth languages.
+	key = (text, get_whitelist(), get_fallback(), defaultLang, synthClass)
+	# Most recent results by hash first, this needs no lock and no LRU bookkeeping
+	slot = hash(key) & (_RECENT_SIZE - 1)
+	recentKey, lang = _recent[slot]
+	if recentKey == key:
+		return lang
+	with _detectCacheLock:
+		lang = _detectCache.get(key)
+		if lang is not None:
+			_detectCache.move_to_end(key)
+	if lang is not None:
+		_recent[slot] = (key, lang)
+		return lang
+
+	# Bursts of speech (e.g. typing, scrolling) are most likely in the language just detected
+	now = time.monotonic_ns()
+	lastTime, lastStart, lastEnd, lastSettings, lastLang = _lastDetect
+	if (
+		now - lastTime < DEBOUNCE_TIME
+		and lastSettings == key[1:]
+		and (text[:DEBOUNCE_LENGTH] == lastStart or text[-DEBOUNCE_LENGTH:] == lastEnd)
+	):
+		return lastLang
+
+	# Detect in the background, so slow detection (e.g. loading the model) can't block speech
+	startDetectThread()
+	request = _DetectRequest(key, getAllowedLangs(), synthLangs)
+	try:
+		_detectQueue.put_nowait(request)
+	except queue.Full:
+		log.debug('LangDetectSpeech: Detection queue full, using default language')
+		return defaultLang
+	if not request.done.wait(DETECT_TIMEOUT):
+		log.debug('LangDetectSpeech: Detection timed out, using default language')
+		return defaultLang
+	_recent[slot] = (key, request.lang)
+	_lastDetect = (now, text[:DEBOUNCE_LENGTH], text[-DEBOUNCE_LENGTH:], key[1:], request.lang)
+	return request.lang
+
+
+# Detection results for recent utterances, least recently used first
+_detectCache = OrderedDict()
+# Direct-mapped cache of (key, lang) in front of _detectCache, indexed by the key's hash
+_RECENT_SIZE = 64
+_recent = [(None, None)] * _RECENT_SIZE
+# (time, text start, text end, settings, lang) of the last detection, see DEBOUNCE_TIME
+_lastDetect = (0, None, None, None, None)
+_detectCacheLock = threading.Lock()
+_detectQueue = queue.Queue(maxsize=8)
+_detectThread = None
+
+
+class _DetectRequest:
+	"""A detection handed to the detection thread, which sets done when lang is available."""
+
+	def __init__(self, key, allowed, langs):
+		self.key = key
+		# Languages at the time of the request, the synth and settings may change meanwhile
+		self.allowed = allowed
+		self.langs = langs
+		self.lang = None
+		self.done = threading.Event()
+
+
+def clearDetectCache():
+	"""Forget cached detection results, e.g. after the settings changed."""
+	with _detectCacheLock:
+		_detectCache.clear()
+	_recent[:] = [(None, None)] * _RECENT_SIZE
+
+
+def startDetectThread():
+	"""Start the detection thread if it isn't running yet."""
+	global _detectThread
+	if _detectThread is None:
+		_detectThread = threading.Thread(
+			target=_detectThreadFunc, name='LangDetectSpeech detection', daemon=True)
+		_detectThread.start()
+
+
+def stopDetectThread():
+	"""Stop the detection thread after pending detections are done."""
+	global _detectThread
+	if _detectThread is not None:
+		_detectQueue.put(None)
+		_detectThread.join()
+		_detectThread = None
+
+
+def _detectThreadFunc():
+	running = True
+	while running:
+		requests = [_detectQueue.get()]
+		# Speech often comes in bursts (e.g. opening a menu), so detect all pending text at once
+		while len(requests) < DETECT_BATCH_SIZE:
+			try:
+				requests.append(_detectQueue.get_nowait())
+			except queue.Empty:
+				break
+		if None in requests:
+			running = False
+			requests = [request for request in requests if request is not None]
+		try:
+			_detectRequests(requests)
+		except Exception:
+			log.error('LangDetectSpeech: Detection failed', exc_info=True)
+		for request in requests:
+			if request.lang is None:
+				# Detection failed, use the default language
+				request.lang = request.key[3]
+			request.done.set()
+
+
+def _detectRequests(requests):
+	"""Set the language of requests from the cache, or by detecting them together."""
+	pending = []
+	with _detectCacheLock:
+		for request in requests:
+			request.lang = _detectCache.get(request.key)
+			# Skip text already detected for an earlier request, e.g. one that timed out
+			if request.lang is None:
+				pending.append(request)
+	if not pending:
+		return
+
+	langs = _detect([
+		(request.key[0], request.allowed, request.key[2], request.key[3], request.langs)
+		for request in pending
+	])
+	with _detectCacheLock:
+		for request, lang in zip(pending, langs):
+			request.lang = lang
+			_detectCache[request.key] = lang
+		while len(_detectCache) > DETECT_CACHE_SIZE:
+			_detectCache.popitem(last=False)
+
+
+# Languages not written in Latin script. Pure ASCII text can't be in one of these.
+_NON_LATIN_LANGS = frozenset((
+	'am', 'ar', 'as', 'be', 'bg', 'bn', 'bo', 'ckb', 'el', 'fa', 'gu', 'he', 'hi', 'hy', 'ja', 'ka',
+	'kk', 'km', 'kn', 'ko', 'ky', 'lo', 'mk', 'ml', 'mn', 'mr', 'my', 'ne', 'or', 'pa', 'ps', 'ru',
+	'sa', 'sd', 'si', 'ta', 'te', 'tg', 'th', 'tt', 'ug', 'uk', 'ur', 'yi', 'zh',
+))
+
+# Scripts with the character ranges and the languages written in them
+_SCRIPTS = {
+	'latin': ('A-Za-z\u00c0-\u024f\u1e00-\u1eff', ()),
+	'cyrillic': ('\u0400-\u052f', ('ru', 'uk', 'be', 'bg', 'mk', 'sr', 'kk', 'ky', 'mn', 'tg', 'tt')),
+	'greek': ('\u0370-\u03ff', ('el',)),
+	'armenian': ('\u0530-\u058f', ('hy',)),
+	'hebrew': ('\u0590-\u05ff', ('he', 'yi')),
+	'arabic': ('\u0600-\u06ff\u0750-\u077f', ('ar', 'fa', 'ur', 'ps', 'ckb', 'ug', 'sd')),
+	'devanagari': ('\u0900-\u097f', ('hi', 'mr', 'ne', 'sa')),
+	'bengali': ('\u0980-\u09ff', ('bn', 'as')),
+	'gurmukhi': ('\u0a00-\u0a7f', ('pa',)),
+	'gujarati': ('\u0a80-\u0aff', ('gu',)),
+	'oriya': ('\u0b00-\u0b7f', ('or',)),
+	'tamil': ('\u0b80-\u0bff', ('ta',)),
+	'telugu': ('\u0c00-\u0c7f', ('te',)),
+	'kannada': ('\u0c80-\u0cff', ('kn',)),
+	'malayalam': ('\u0d00-\u0d7f', ('ml',)),
+	'sinhala': ('\u0d80-\u0dff', ('si',)),
+	'thai': ('\u0e00-\u0e7f', ('th',)),
+	'lao': ('\u0e80-\u0eff', ('lo',)),
+	'tibetan': ('\u0f00-\u0fff', ('bo',)),
+	'myanmar': ('\u1000-\u109f', ('my',)),
+	'georgian': ('\u10a0-\u10ff', ('ka',)),
+	'hangul': ('\u1100-\u11ff\u3130-\u318f\uac00-\ud7af', ('ko',)),
+	'ethiopic': ('\u1200-\u137f', ('am',)),
+	'khmer': ('\u1780-\u17ff', ('km',)),
+	'kana': ('\u3040-\u30ff', ('ja',)),
+	'han': ('\u4e00-\u9fff', ('zh', 'ja')),
+}
+_SCRIPT_LANGS = {script: frozenset(langs) for script, (chars, langs) in _SCRIPTS.items()}
+_SCRIPT_PATTERN = re.compile('|'.join(
+	'(?P<{0}>[{1}]+)'.format(script, chars) for script, (chars, langs) in _SCRIPTS.items()
+))
+
+
+def getDominantScript(text):
+	"""Get the script of the majority of letters in text, or None if there is no majority."""
+	counts = {}
+	total = 0
+	for match in _SCRIPT_PATTERN.finditer(text):
+		length = match.end() - match.start()
+		counts[match.lastgroup] = counts.get(match.lastgroup, 0) + length
+		total += length
+	if not counts:
+		return None
+	script = max(counts, key=counts.get)
+	# Japanese mixes kana and han, any kana means Japanese
+	if script == 'han' and 'kana' in counts:
+		return 'kana'
+	return script if counts[script] * 2 > total else None
+
+
+def _detect(items):
+	"""Detect the language of texts and return the matching languages of the synth.
+
+	items is a list of (text, allowed, fallback, defaultLang, langs) tuples,
+	with langs being the synthLangs to choose from and allowed the result of getAllowedLangs().
+	"""
+	predictedLangs = [None] * len(items)
+	toPredict = []
+	for i, (text, allowed, fallback, defaultLang, langs) in enumerate(items):
+		if 'en' in allowed and text.isascii() and not (allowed - _NON_LATIN_LANGS - {'en'}):
+			# English is the only allowed language that can be written in pure ASCII
+			predictedLangs[i] = 'en'
+			continue
+
+		if not text.isascii():
+			# Text in a script used by only one allowed language doesn't need the detector
+			script = getDominantScript(text)
+			if script is not None:
+				candidates = allowed & _SCRIPT_LANGS[script]
+				if len(candidates) == 1:
+					predictedLangs[i], = candidates
+					continue
+
+		toPredict.append((i, items[i]))
+
+	if toPredict:
+		predictions = _predictLanguages([item for i, item in toPredict])
+		for (i, item), predictedLang in zip(toPredict, predictions):
+			predictedLangs[i] = predictedLang
+
+	synthLangsResult = []
+	for (text, allowed, fallback, defaultLang, langs), predictedLang in zip(items, predictedLangs):
+		# Don't use a different dialect due to sorting
+		if defaultLang.lower().startswith(predictedLang):
+			synthLangsResult.append(defaultLang)
+		else:
+			synthLangsResult.append(langs.get(predictedLang, defaultLang))
+	return synthLangsResult
+
+
+def _predictLanguages(items):
+	"""Predict the language codes of texts using fast-langdetect.
+
+	items is a list of (text, allowed, fallback, defaultLang, langs) tuples.
+	"""
+	global detector
 
 	# Initialize detector if needed
 	if detector is None:
 		init_detector()
 
+	# Get top 5 candidates of each text, fewer if there are only a few allowed languages.
+	# FastText can't restrict its labels, but a smaller k makes its top-k selection cheaper.
+	k = min(5, max(len(allowed) for text, allowed, fallback, defaultLang, langs in items) + 2)
 	try:
-		# Detect language using fast-langdetect
-		results = detector.detect(text, k=5)  # Get top 5 candidates
-		whitelist = get_whitelist()
+		# Detect languages using fast-langdetect
+		allResults = detector.detect_many([item[0] for item in items], k=k)
+	except Exception as e:
+		log.debug('LangDetectSpeech: Detection error: ' + str(e))
+		return [defaultLang.split('_')[0].lower() for text, allowed, fallback, defaultLang, langs in items]
 
+	predictedLangs = []
+	for (text, allowed, fallback, defaultLang, langs), results in zip(items, allResults):
 		predictedLang = None
 		for result in results:
-			lang = result['lang'].lower()
-			# Check if language is in whitelist (if whitelist is set)
-			if not whitelist or lang in whitelist:
-				# Check if language is supported by synth
-				if lang in synthLangs:
-					predictedLang = lang
-					break
+			# fast-langdetect labels are lowercase like the keys of synthLangs
+			lang = result['lang']
+			if lang in allowed:
+				predictedLang = lang
+				break
 
 		# Fallback to default if no match
 		if predictedLang is None:
-			fallback_lang = get_fallback()
-			if fallback_lang in synthLangs:
-				predictedLang = fallback_lang
+			if fallback in langs:
+				predictedLang = fallback
 
 		if predictedLang is None:
 			predictedLang = defaultLang.split('_')[0].lower()
 
 		log.debug('PREDICTED={0} TEXT={1}'.format(str(predictedLang), text))
+		predictedLangs.append(predictedLang)
+	return predictedLangs
 
-	except Exception as e:
-		log.debug('LangDetectSpeech: Detection error: ' + str(e))
-		predictedLang = defaultLang.split('_')[0].lower()
 
-	# Don't use a different dialect due to sorting
-	if defaultLang.lower().startswith(predictedLang):
-		return defaultLang
-	else:
-		return synthLangs.get(predictedLang, defaultLang)
+# LangChangeCommands only hold the language, so one instance per language is reused
+_langChangeCommands = {}
+
+
+def getLangChangeCommand(lang):
+	"""Get the shared LangChangeCommand for lang."""
+	command = _langChangeCommands.get(lang)
+	if command is None:
+		command = _langChangeCommands[lang] = LangChangeCommand(lang)
+	return command
 
 
 def speechSequenceFilter(speechSequence, *args, **kwargs):
 	"""Filter function that processes speech sequences and injects language commands."""
-	# Update synth languages if synthesizer changed
-	updateSynthLangs()
-
-	# Collect all text for language detection
-	text = ''
+	# Collect text and everything but (default language) LangChangeCommands in a single pass
+	textParts = []
+	items = []
 	for item in speechSequence:
 		if isinstance(item, str):
-			text += item
+			textParts.append(item)
+		elif isinstance(item, LangChangeCommand):
+			if item.lang:
+				# Keep the language NVDA already knows, e.g. from the document's language attribute
+				return speechSequence
+			continue
+		items.append(item)
+	text = ''.join(textParts)
 
 	if not text.strip():
 		return speechSequence
 
+	# Update synth languages if synthesizer changed
+	updateSynthLangs()
+
 	detectedLang = detectLanguage(text)
 
-	# Build new sequence: prepend detected language, strip existing LangChangeCommands
-	newSequence = [LangChangeCommand(detectedLang)]
-	for item in speechSequence:
-		if not isinstance(item, LangChangeCommand):
-			newSequence.append(item)
+	# Build new sequence: prepend detected language to the collected items
+	newSequence = [getLangChangeCommand(detectedLang)]
+	newSequence.extend(items)
 
 	log.debug('LangDetectSpeech: Injected LangChangeCommand({0})'.format(detectedLang))
 	log.debug('LangDetectSpeech: ' + str(newSequence))
@@ -198,6 +540,12 @@ class GlobalPlugin(globalPluginHandler.GlobalPlugin):
 		filter_speechSequence.register(speechSequenceFilter)
 		log.debug('LangDetectSpeech: Registered speech sequence filter')
 
+		# Load the model in the background, so it's ready for the first speech
+		threading.Thread(target=init_detector, name='LangDetectSpeech init', daemon=True).start()
+
+		# Settings may differ between configuration profiles
+		config.post_configProfileSwitch.register(invalidateConfigCache)
+
 		# Warn if automatic language switching is disabled (after NVDA fully starts)
 		core.postNvdaStartup.register(self._checkAutoLangSwitching)
 
@@ -222,6 +570,10 @@ class GlobalPlugin(globalPluginHandler.GlobalPlugin):
 		filter_speechSequence.unregister(speechSequenceFilter)
 		log.debug('LangDetectSpeech: Unregistered speech sequence filter')
 
+		config.post_configProfileSwitch.unregister(invalidateConfigCache)
+
+		stopDetectThread()
+
 		# Remove settings panel
 		gui.settingsDialogs.NVDASettingsDialog.categoryClasses.remove(LangDetectSpeechSettings)
 
@@ -236,11 +588,8 @@ class LangDetectSpeechSettings(SettingsPanel):
 		# Ensure synth languages are up to date
 		updateSynthLangs()
 
-		# Build list of languages with display names: [(code, displayName), ...]
-		self._languages = []
-		for langCode in sorted(synthLangs.keys()):
-			displayName = getLanguageDisplayName(langCode)
-			self._languages.append((langCode, displayName))
+		# Languages with display names: ((code, displayName), ...)
+		self._languages = getSynthLangsDisplay()
 
 		synthName = speech.synthDriverHandler.getSynth().name
 		# Translators: Label for the languages section. {0} is the synthesizer name.
@@ -300,6 +649,10 @@ class LangDetectSpeechSettings(SettingsPanel):
 		if selection >= 0 and selection < len(self._languages):
 			config.conf['LangDetectSpeech']['fallback'] = self._languages[selection][0]
 
+		# Settings changed, cached settings and detection results are outdated
+		invalidateConfigCache()
+		clearDetectCache()
+
 		log.debug('LangDetectSpeech: Updated settings - whitelist: {0}, fallback: {1}'.format(
 			newWhitelist, config.conf['LangDetectSpeech']['fallback']))
 
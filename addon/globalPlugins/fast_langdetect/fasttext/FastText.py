@@ -7,25 +7,34 @@
 import os
 import sys
 import glob as _glob
+import importlib.machinery
 import importlib.util
 import platform
 
-# Find the pyd file in parent directory matching the current Python version and platform
+
+def _load_pybind(path):
+    """Load the fasttext_pybind extension module from path."""
+    loader = importlib.machinery.ExtensionFileLoader("fasttext_pybind", path)
+    spec = importlib.util.spec_from_file_location("fasttext_pybind", path, loader=loader)
+    module = importlib.util.module_from_spec(spec)
+    loader.exec_module(module)
+    return module
+
+
+# Load the pyd file in parent directory matching the current Python version and platform
 _parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 _ver = f"cp{sys.version_info.major}{sys.version_info.minor}"
 _arch = "win_amd64" if platform.machine() == "AMD64" else "win32"
-_pyd_specific = os.path.join(_parent_dir, f"fasttext_pybind.{_ver}-{_arch}.pyd")
-if os.path.exists(_pyd_specific):
-    _pyd_path = _pyd_specific
-else:
-    # Fall back to any available pyd
+_pyd_path = os.path.join(_parent_dir, f"fasttext_pybind.{_ver}-{_arch}.pyd")
+try:
+    fasttext = _load_pybind(_pyd_path)
+except ImportError:
+    # Fall back to any available pyd, only searched if the expected one is missing
     _pyd_files = _glob.glob(os.path.join(_parent_dir, "fasttext_pybind*.pyd"))
     if not _pyd_files:
         raise ImportError(f"Cannot find fasttext_pybind*.pyd in {_parent_dir}")
     _pyd_path = _pyd_files[0]
-_spec = importlib.util.spec_from_file_location("fasttext_pybind", _pyd_path)
-fasttext = importlib.util.module_from_spec(_spec)
-_spec.loader.exec_module(fasttext)
+    fasttext = _load_pybind(_pyd_path)
 
 
 class _FastText(object):
@@ -333,6 +333,46 @@ class LangDetector:
         :raises FastLangdetectError: For library-specific failures (e.g., invalid model)
         :raises Exception: Standard Python exceptions propagate, such as MemoryError, FileNotFoundError
         """
+        ft_model = self._select_model(model)
+        text = self._preprocess_text(text)
+        normalized_text = self._normalize_text(text, self.config.normalize_input)
+        labels, scores = ft_model.predict(normalized_text, k=k, threshold=threshold)
+        return self._make_results(labels, scores)
+
+    def detect_many(
+            self,
+            texts: List[str],
+            *,
+            model: Optional[Literal["lite", "full", "auto"]] = None,
+            k: int = 1,
+            threshold: float = 0.0,
+    ) -> List[List[Dict[str, Any]]]:
+        """
+        Detect language candidates of multiple texts with a single model call.
+        Returns a list of results (as returned by detect()) per text.
+
+        :param texts: Input texts
+        :param model: 'lite' | 'full' | 'auto' (auto falls back on MemoryError)
+        :param k: Number of top languages to return per text
+        :param threshold: Minimum confidence threshold
+        :raises FastLangdetectError: For library-specific failures (e.g., invalid model)
+        :raises Exception: Standard Python exceptions propagate, such as MemoryError, FileNotFoundError
+        """
+        if not texts:
+            return []
+        ft_model = self._select_model(model)
+        normalized_texts = [
+            self._normalize_text(self._preprocess_text(text), self.config.normalize_input)
+            for text in texts
+        ]
+        all_labels, all_scores = ft_model.predict(normalized_texts, k=k, threshold=threshold)
+        return [
+            self._make_results(labels, scores)
+            for labels, scores in zip(all_labels, all_scores)
+        ]
+
+    def _select_model(self, model: Optional[Literal["lite", "full", "auto"]]) -> Any:
+        """Get the model backend for the given model selection (config default if None)."""
         # Determine model to use (config default if not provided)
         sel_model: Literal["lite", "full", "auto"]
         if model is None:
@@ -344,15 +384,15 @@ class LangDetector:
 
         # Select model backend
         if sel_model == "lite":
-            ft_model = self._get_model(low_memory=True, fallback_on_memory_error=False)
+            return self._get_model(low_memory=True, fallback_on_memory_error=False)
         elif sel_model == "full":
-            ft_model = self._get_model(low_memory=False, fallback_on_memory_error=False)
+            return self._get_model(low_memory=False, fallback_on_memory_error=False)
         else:
-            ft_model = self._get_model(low_memory=False, fallback_on_memory_error=True)
+            return self._get_model(low_memory=False, fallback_on_memory_error=True)
 
-        text = self._preprocess_text(text)
-        normalized_text = self._normalize_text(text, self.config.normalize_input)
-        labels, scores = ft_model.predict(normalized_text, k=k, threshold=threshold)
+    @staticmethod
+    def _make_results(labels, scores) -> List[Dict[str, Any]]:
+        """Convert FastText labels and scores to results sorted by score."""
         results = [
             {
                 "lang": label.replace("__label__", ""),